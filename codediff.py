@@ -7,7 +7,7 @@
 '''
 Diff two files/directories and produce HTML pages.
 Class: CodeDiffer
-Method: make_diff()
+Method: make_diff(), merge_shards()
 Exception: CodeDifferError
 Following templates could be customized after init:
     _index_template
@@ -15,16 +15,25 @@ Following templates could be customized after init:
     _header_info_template
     _comments_template
     _summary_info_template
+    _budget_info_template
+    _search_info_template
     _data_rows_template
     _diff_data_row_template
+    _udiff_data_row_template
+    _stats_data_row_template
+    _too_large_data_row_template
     _deleted_data_row_template
     _added_data_row_template
+    _group_page_template
+    _group_member_template
     _footer_info_template
 '''
 
 _self_name = 'coderev'
 
-import sys, os, stat, errno, time, re, difflib, filecmp, urllib
+import sys, os, stat, errno, time, re, difflib, filecmp, urllib, json
+import signal
+import hashlib
 
 _global_dir_ignore_list = (
     r'^CVS$',
@@ -41,6 +50,22 @@ _global_file_ignore_list = (
     r'^\.cvsignore$',
 )
 
+# Rendering levels used when a file exceeds its budget, from the most to the
+# least expensive one.  A file over budget by up to _budget_factors[1] times is
+# rendered as udiff only, up to _budget_factors[2] times as stats only, beyond
+# that only a placeholder row is produced.
+_budget_full, _budget_udiff, _budget_stats, _budget_skip = range(4)
+_budget_names = ('full', 'udiff only', 'stats only', 'too large')
+_budget_keys = ('full', 'udiff', 'stats', 'skip')
+_budget_factors = (1, 4, 16)
+
+# Name of the prebuilt search index written aside index.html
+_search_index_name = 'search.js'
+
+# Index fragment written by each shard (K, N) and read by merge_shards()
+_shard_fragment_name = '.coderev-shard-%d-of-%d.json'
+_shard_fragment_pattern = r'^\.coderev-shard-(\d+)-of-(\d+)\.json$'
+
 def make_title(pathname, width):
     'Wrap long pathname to abbreviate name to fit the text width'
     if not pathname:
@@ -108,6 +133,105 @@ def udiff_lines(from_lines, to_lines, from_name, to_name,
     return html
 
 
+def udiff_summary(udiff):
+    '''Count changed/deleted/added lines of udiff (a list), a run of deleted
+    lines followed by added lines is counted as changed lines pairwise'''
+    summary = { 'changed': 0, 'added': 0, 'deleted': 0 }
+    old = new = 0
+    for line in udiff[2:] + [' ']:     # skip '---' and '+++' header lines
+        if line[:1] == '-':
+            old += 1
+        elif line[:1] == '+':
+            new += 1
+        else:
+            n = min(old, new)
+            summary['changed'] += n
+            summary['deleted'] += old - n
+            summary['added'] += new - n
+            old = new = 0
+    return summary
+
+
+def udiff_key(udiff):
+    '''Return hash of hunks in udiff (a list), file names and line numbers are
+    ignored so identical changes to different files have the same key'''
+    m = hashlib.md5()
+    for line in udiff[2:]:     # skip '---' and '+++' header lines
+        if line[:2] == '@@':
+            m.update('@@\n')
+        else:
+            m.update(line)
+    return m.hexdigest()
+
+
+def quick_summary(from_lines, to_lines):
+    '''Estimate changed/deleted/added lines without running a real diff, lines
+    are compared as multisets so moved lines are not counted, this costs linear
+    time and is used for files too large to diff'''
+    count = {}
+    for line in from_lines:
+        count[line] = count.get(line, 0) + 1
+    for line in to_lines:
+        count[line] = count.get(line, 0) - 1
+    old = sum([n for n in count.itervalues() if n > 0])
+    new = -sum([n for n in count.itervalues() if n < 0])
+    n = min(old, new)
+    return { 'changed': n, 'deleted': old - n, 'added': new - n }
+
+
+def changed_lines(from_lines, to_lines):
+    'Return lines that appear in only one of from_lines and to_lines'
+    return set(from_lines) ^ set(to_lines)
+
+
+def search_trigrams(lines):
+    'Return set of lowercase trigrams of lines to be added to search index'
+    grams = set()
+    for line in lines:
+        s = line.decode('utf-8', 'replace').strip().lower()
+        grams.update([s[i:i+3] for i in xrange(len(s) - 2)])
+    return grams
+
+
+def update_search_index(index, pathname, url, grams):
+    '''Add pathname to search index (a dict made by new_search_index), grams
+    are trigrams of its changed lines made by search_trigrams()'''
+    n = len(index['files'])
+    index['files'].append(pathname.decode('utf-8', 'replace'))
+    index['urls'].append(url)
+    for g in grams:
+        index['grams'].setdefault(g, []).append(n)
+
+
+def new_search_index():
+    return { 'files': [], 'urls': [], 'grams': {} }
+
+
+def merge_search_index(index, other):
+    'Append files of search index other to index'
+    offset = len(index['files'])
+    index['files'].extend(other['files'])
+    index['urls'].extend(other['urls'])
+    for g, ids in other['grams'].iteritems():
+        index['grams'].setdefault(g, []).extend([i + offset for i in ids])
+
+
+def write_search_index(file, index):
+    '''Write search index as a javascript file so it can be loaded without a
+    server, posting lists of trigrams are delta encoded to keep it compact'''
+    grams = {}
+    for g, ids in index['grams'].iteritems():
+        last = 0
+        deltas = []
+        for i in ids:
+            deltas.append(i - last)
+            last = i
+        grams[g] = deltas
+    data = json.dumps(dict(files=index['files'], urls=index['urls'],
+                           grams=grams), separators=(',', ':'))
+    write_file(file, 'var coderev_search = %s;\n' % data)
+
+
 def html_filter(s):
     return s.replace('&', '&amp;').replace('>', '&gt;').replace('<', '&lt;')
 
@@ -273,6 +397,15 @@ class CodeDifferError(Exception):
     pass
 
 
+class _BudgetTimeout(Exception):
+    'Raised when rendering a file runs out of its time budget'
+    pass
+
+
+def _raise_budget_timeout(signum, frame):
+    raise _BudgetTimeout
+
+
 class CodeDiffer:
 
     # index page layout (templates are public):
@@ -282,11 +415,17 @@ class CodeDiffer:
     #   comments here
     # summary of files
     #   Changed Deleted Added
+    # search box (queries search.js, file paths and changed lines)
+    # budget decisions (only when some file exceeded its budget)
     # Filename C/D/A Summary      Diffs                  Sources
     # Pathname x/y/z         Cdiff  Udiff  Sdiff  Fdiff  Old New
     # Pathname x/y/z         Cdiff  Udiff  Sdiff  Fdiff  Old New
     # Pathname x/y/z         -      -      -      -      -   New
     # Pathname x/y/z         -      -      -      -      Old -
+    # Pathname x/y/z         -      Udiff  udiff only    -   -
+    # Pathname x/y/z         -      stats only           -   -
+    # Pathname x/y/z  -/-/-  too large                   -   -
+    # Pathname (N files)     Cdiff  Udiff  Sdiff  Fdiff  Old New
     # <hr>
     # footer_info
     #
@@ -312,6 +451,8 @@ class CodeDiffer:
     %(header_info)s
     %(comments_info)s
     %(summary_info)s
+    %(budget_info)s
+    %(search_info)s
     %(data_rows)s
     <hr>
     %(footer_info)s
@@ -328,11 +469,15 @@ class CodeDiffer:
         border: 1px solid #ccc; border-collapse: collapse
     }
     td {padding-left:5px;padding-right:5px;}
-    #summary {margin-left: 16px; border:medium;text-align:center;}
+    #summary, #budget_summary {
+        margin-left: 16px; border:medium;text-align:center;
+    }
     #footer_info {color:#333; font-size:8pt;}
     .diff {background-color:#ffd;}
     .added {background-color:#afa;}
     .deleted {background-color:#faa;}
+    .degraded {background-color:#eee;}
+    #search_result {margin-left: 16px;}
     .table_header th {
         text-align:center;
         background-color:#f0f0f0;
@@ -358,6 +503,68 @@ class CodeDiffer:
         </tr>
     </table><br>"""
 
+    _budget_info_template = """
+    <p><b>Files over budget (%(limits)s):</b></p>
+    <table id="budget_summary">
+        <tr>
+            <td class="diff">%(udiff)d Udiff only</td>
+            <td class="diff">%(stats)d Stats only</td>
+            <td class="degraded">%(skip)d Too large</td>
+        </tr>
+    </table><br>"""
+
+    # No '%' is allowed in script other than the format keys
+    _search_info_template = """
+    <p><b>Search file names and changed lines:</b>
+        <input type="text" id="search_box" size="40"
+               onkeyup="coderev_search_run(this.value)" /></p>
+    <ul id="search_result"></ul>
+    <script type="text/javascript" src="%(search_index)s"></script>
+    <script type="text/javascript">
+    function coderev_search_run(q) {
+        var idx = window.coderev_search, hits = {}, order = [], html = '';
+        var has = Object.prototype.hasOwnProperty, i, j, k, n, p, s, cand;
+        var result = document.getElementById('search_result');
+        q = q.toLowerCase().replace(/^\\s+|\\s+$/g, '');
+        if (!idx || !q) { result.innerHTML = ''; return; }
+        for (i = 0; i < idx.files.length; i++) {
+            if (idx.files[i].toLowerCase().indexOf(q) >= 0) {
+                hits[i] = 'name';
+                order.push(i);
+            }
+        }
+        if (q.length >= 3) {
+            cand = null;
+            for (i = 0; i + 3 <= q.length; i++) {
+                k = q.substr(i, 3);
+                p = has.call(idx.grams, k) ? idx.grams[k] : [];
+                s = {};
+                for (j = 0, n = 0; j < p.length; j++) {
+                    n += p[j];
+                    if (cand === null || cand[n]) s[n] = true;
+                }
+                cand = s;
+            }
+            for (i in cand) {
+                if (has.call(cand, i) && !hits[i]) {
+                    hits[i] = 'diff';
+                    order.push(i);
+                }
+            }
+        }
+        for (i = 0; i < order.length && i < 200; i++) {
+            k = idx.files[order[i]].replace(/&/g, '&amp;')
+                .replace(/</g, '&lt;').replace(/>/g, '&gt;');
+            if (idx.urls[order[i]])
+                k = '<a href="' + idx.urls[order[i]] + '">' + k + '</a>';
+            html += '<li>' + k + ' (' + hits[order[i]] + ')</li>';
+        }
+        if (order.length > 200)
+            html += '<li>... ' + (order.length - 200) + ' more</li>';
+        result.innerHTML = html || '<li>No match</li>';
+    }
+    </script>"""
+
     _data_rows_template = """
     <table id="summary_table" cellspacing="1" border="1" nowrap="nowrap">
     <tr class="table_header">
@@ -386,6 +593,38 @@ class CodeDiffer:
         <td><a href="%(pathname_url)s.html" title="new file">New</a></td>
     </tr>"""
 
+    _udiff_data_row_template = """
+    <tr class="diff">
+        <td>%(pathname)s</td>
+        <td><abbr title="Changed/Deleted/Added">\
+                %(changed)s/%(deleted)s/%(added)s</abbr></td>
+        <td>-</td>
+        <td><a href="%(pathname_url)s.udiff.html" title="unified diff">Udiff</a>\
+                </td>
+        <td colspan="2"><abbr title="%(reason)s">udiff only</abbr></td>
+        <td>-</td>
+        <td>-</td>
+    </tr>"""
+
+    _stats_data_row_template = """
+    <tr class="diff">
+        <td>%(pathname)s</td>
+        <td><abbr title="Changed/Deleted/Added (estimated)">\
+                ~%(changed)s/%(deleted)s/%(added)s</abbr></td>
+        <td colspan="4"><abbr title="%(reason)s">stats only</abbr></td>
+        <td>-</td>
+        <td>-</td>
+    </tr>"""
+
+    _too_large_data_row_template = """
+    <tr class="degraded">
+        <td>%(pathname)s</td>
+        <td>-/-/-</td>
+        <td colspan="4"><abbr title="%(reason)s">too large</abbr></td>
+        <td>-</td>
+        <td>-</td>
+    </tr>"""
+
     _deleted_data_row_template = """
     <tr class="deleted">
         <td>%(pathname)s</td>
@@ -410,6 +649,21 @@ class CodeDiffer:
         <td><a href="%(pathname_url)s.html" title="new file">New</a></td>
     </tr>"""
 
+    _group_page_template = """<html><head>
+    <title>Files with identical change to %(pathname)s</title>
+    <style type="text/css">
+        body {font-family: monospace; font-size: 9pt;}
+    </style>
+    </head><body>
+    <p><b>%(count)d files have identical change, rendered once as
+        <a href="%(page)s">%(pathname)s</a>, unified diff of each file:</b></p>
+    <ul>%(members)s
+    </ul>
+    </body></html>"""
+
+    _group_member_template = """
+        <li><a href="%(pathname_url)s.udiff.html">%(pathname)s</a></li>"""
+
     _footer_info_template = """
     <i id="footer_info">
         Generated by %(myname)s at %(time)s
@@ -419,7 +673,8 @@ class CodeDiffer:
 
 
     def __init__(self, obj1, obj2, output, input_list=None, strip_level=0,
-                       wrap_num=0, context_line=3, title='', comments=''):
+                       wrap_num=0, context_line=3, title='', comments='',
+                       max_lines=0, max_bytes=0, max_seconds=0, shard=None):
         self.__obj1 = obj1
         self.__obj2 = obj2
         self.__output = output
@@ -430,6 +685,10 @@ class CodeDiffer:
         self.__file_list = []
         self.__title = title
         self.__comments = comments
+        self.__max_lines = max_lines
+        self.__max_bytes = max_bytes
+        self.__max_seconds = max_seconds
+        self.__shard = shard    # (K, N) to process K-th of N shards only
         # TODO: provide options
         self.__dir_ignore_list = _global_dir_ignore_list
         self.__file_ignore_list = _global_file_ignore_list
@@ -448,6 +707,84 @@ class CodeDiffer:
                            use_context, self.__wrap_num, self.__context_line)
         write_file(self.__output, html)
 
+    def __check_budget(self, nbytes, nlines=0):
+        '''
+        Decide how to render a file pair by its size, return rendering level
+        and the reason (empty if within budget)
+        '''
+        level, reason = _budget_full, ''
+        for size, limit, unit in ((nbytes, self.__max_bytes, 'bytes'),
+                                  (nlines, self.__max_lines, 'lines')):
+            if not limit or size <= limit:
+                continue
+            n = _budget_skip
+            for i in range(len(_budget_factors)):
+                if size <= limit * _budget_factors[i]:
+                    n = i
+                    break
+            if n > level:
+                level, reason = n, '%d %s > %d %s' % (size, unit, limit, unit)
+        return level, reason
+
+    def __run_timed(self, started, func, *args):
+        '''
+        Call func(*args) for a file whose rendering started at time started,
+        raise _BudgetTimeout if time budget of the file is used up before or
+        during the call (interrupted by SIGALRM where supported)
+        '''
+        if not self.__max_seconds:
+            return func(*args)
+        remaining = started + self.__max_seconds - time.time()
+        if remaining <= 0:
+            raise _BudgetTimeout
+        if not hasattr(signal, 'setitimer'):
+            return func(*args)
+
+        handler = signal.signal(signal.SIGALRM, _raise_budget_timeout)
+        signal.setitimer(signal.ITIMER_REAL, remaining)
+        try:
+            return func(*args)
+        finally:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+            signal.signal(signal.SIGALRM, handler)
+
+    def __render_source(self, obj, nbytes, started):
+        '''
+        Render source page of an added or deleted file within its budget,
+        return rendering level, reason, html (None if not full) and lines
+        (empty if too large)
+        '''
+        lines = []
+        level, reason = self.__check_budget(nbytes)
+        if level < _budget_skip:
+            lines = get_lines(obj)
+            level, reason = self.__check_budget(nbytes, len(lines))
+        # Udiff of a whole file costs as much as its source page
+        if level == _budget_udiff:
+            level = _budget_stats
+
+        html = None
+        if level == _budget_full:
+            try:
+                html = self.__run_timed(started, convert_to_html, obj)
+            except _BudgetTimeout:
+                level, reason = _budget_stats, self.__time_reason(started)
+        return level, reason, html, lines
+
+    def __search_grams(self, started, func, *args):
+        '''
+        Return trigrams made by func(*args) for search index within time
+        budget of the file, no trigrams (file path only) if out of time
+        '''
+        try:
+            return self.__run_timed(started, func, *args)
+        except _BudgetTimeout:
+            return set()
+
+    def __time_reason(self, started):
+        return '%.2f seconds > %s seconds' % (time.time() - started,
+                                              self.__max_seconds)
+
     def __is_igore_dir(self, dir):
         for pat in self.__dir_ignore_list:
             if re.match(pat, dir):
@@ -502,10 +839,13 @@ class CodeDiffer:
             self.__file_list = c
 
     def __diff_dir_by_list(self):
-        data_rows = ''
+        data_rows = []
         data_row = ''
+        groups = {}
         summary = { 'changed': 0, 'added': 0, 'deleted': 0 }
         file_summary = { 'changed': 0, 'added': 0, 'deleted': 0 }
+        budget = { 'udiff': 0, 'stats': 0, 'skip': 0 }
+        search = new_search_index()
         has_diff = False
 
         self.__file_list.sort()
@@ -541,9 +881,31 @@ class CodeDiffer:
                 if not stat.S_ISREG(stat1[0]) or is_binary_file(obj1):
                     print '(skipped dir/special/binary)'
                     continue
-                print
-                write_file(target + '-.html', convert_to_html(obj1))
-                data_row = self._deleted_data_row_template % {'pathname': f, 'pathname_url': f_url}
+                started = time.time()
+                level, reason, html, lines = self.__render_source(obj1,
+                        stat1[6], started)
+                if level == _budget_full:
+                    print
+                    write_file(target + '-.html', html)
+                    update_search_index(search, f, f_url + '-.html',
+                        self.__search_grams(started, search_trigrams, lines))
+                    data_row = self._deleted_data_row_template % {'pathname': f, 'pathname_url': f_url}
+                else:
+                    print '(%s, %s)' % (_budget_names[level], reason)
+                    if level == _budget_stats:
+                        template = self._stats_data_row_template
+                    else:
+                        template = self._too_large_data_row_template
+                    data_row = template % dict(
+                        pathname = f,
+                        pathname_url = f_url,
+                        changed = 0,
+                            deleted = len(lines),
+                            added = 0,
+                        reason = 'removed file, ' + reason,
+                    )
+                    update_search_index(search, f, '', set())
+                    budget[_budget_keys[level]] += 1
                 summary['deleted'] += 1
                 has_diff = True
 
@@ -553,9 +915,31 @@ class CodeDiffer:
                 if not stat.S_ISREG(stat2[0]) or is_binary_file(obj2):
                     print '(skipped special/binary)'
                     continue
-                print
-                write_file(target + '.html', convert_to_html(obj2))
-                data_row = self._added_data_row_template % {'pathname': f, 'pathname_url': f_url}
+                started = time.time()
+                level, reason, html, lines = self.__render_source(obj2,
+                        stat2[6], started)
+                if level == _budget_full:
+                    print
+                    write_file(target + '.html', html)
+                    update_search_index(search, f, f_url + '.html',
+                        self.__search_grams(started, search_trigrams, lines))
+                    data_row = self._added_data_row_template % {'pathname': f, 'pathname_url': f_url}
+                else:
+                    print '(%s, %s)' % (_budget_names[level], reason)
+                    if level == _budget_stats:
+                        template = self._stats_data_row_template
+                    else:
+                        template = self._too_large_data_row_template
+                    data_row = template % dict(
+                        pathname = f,
+                        pathname_url = f_url,
+                        changed = 0,
+                            deleted = 0,
+                            added = len(lines),
+                        reason = 'new file, ' + reason,
+                    )
+                    update_search_index(search, f, '', set())
+                    budget[_budget_keys[level]] += 1
                 summary['added'] += 1
                 has_diff = True
 
@@ -573,57 +957,234 @@ class CodeDiffer:
                     continue
 
                 has_diff = True
+                started = time.time()
                 from_date = time.ctime(stat1[8])
                 to_date = time.ctime(stat2[8])
-                from_lines = get_lines(obj1)
-                to_lines = get_lines(obj2)
-
-                # Cdiff
-                file_summary, html = cdiff_lines(from_lines, to_lines, obj1,
-                        obj2, from_date, to_date, self.__context_line)
-                write_file(target + '.cdiff.html', html)
-
-                # Udiff
-                html = udiff_lines(from_lines, to_lines, obj1, obj2, from_date,
-                                   to_date, self.__context_line)
-                write_file(target + '.udiff.html', html)
-
-                # Sdiff
-                html = sdiff_lines(from_lines, to_lines, obj1, obj2, True,
-                                   self.__wrap_num, self.__context_line)
-                write_file(target + '.sdiff.html', html)
+                nbytes = max(stat1[6], stat2[6])
+                level, reason = self.__check_budget(nbytes)
+                if level < _budget_skip:
+                    from_lines = get_lines(obj1)
+                    to_lines = get_lines(obj2)
+                    level, reason = self.__check_budget(nbytes,
+                            max(len(from_lines), len(to_lines)))
+
+                group = None
+                if level <= _budget_udiff:
+                    # Udiff goes first since it is the fallback of all others,
+                    # and it tells whether the same change was rendered before
+                    try:
+                        udiff = self.__run_timed(started,
+                            lambda: list(difflib.unified_diff(from_lines,
+                                to_lines, obj1, obj2, from_date, to_date,
+                                self.__context_line)))
+                    except _BudgetTimeout:
+                        level = _budget_stats
+                        reason = self.__time_reason(started)
+
+                if level <= _budget_udiff:
+                    key = udiff_key(udiff)
+                    group = groups.get(key)
+
+                if group:
+                    # Only the udiff (already computed) is kept for a member,
+                    # other pages are shared with the first file of the group
+                    html = udiff_to_html(udiff,
+                                         'Udiff of %s and %s' % (obj1, obj2))
+                    write_file(target + '.udiff.html', html)
+                    group['members'].append(f)
+                    print '  * %-40s |' % f,
+                    print 'Changed/Deleted/Added: %s/%s/%s' % (\
+                        group['summary']['changed'],
+                        group['summary']['deleted'],
+                        group['summary']['added']),
+                    print '(same change as %s)' % group['pathname']
+                    grams = set()
+                    if level == _budget_full:
+                        grams = self.__search_grams(started, lambda:
+                            search_trigrams(changed_lines(from_lines,
+                                                          to_lines)))
+                    update_search_index(search, f, f_url + '.udiff.html',
+                                        grams)
+                    summary['changed'] += 1
+                    continue
 
-                # Fdiff
-                html = sdiff_lines(from_lines, to_lines, obj1, obj2, False,
-                                   self.__wrap_num, self.__context_line)
-                write_file(target + '.fdiff.html', html)
+                if level <= _budget_udiff:
+                    file_summary = udiff_summary(udiff)
+                    html = udiff_to_html(udiff,
+                                         'Udiff of %s and %s' % (obj1, obj2))
+                    write_file(target + '.udiff.html', html)
+
+                if level == _budget_full:
+                    # Every page below is rendered within the time budget, if
+                    # it runs out, pages already written are removed and the
+                    # file falls back to udiff only
+                    pages = []
+                    try:
+                        # Cdiff
+                        cdiff_summary, html = self.__run_timed(started,
+                            lambda: cdiff_lines(from_lines, to_lines, obj1,
+                                obj2, from_date, to_date,
+                                self.__context_line))
+                        pages.append(target + '.cdiff.html')
+                        write_file(pages[-1], html)
+
+                        # Sdiff
+                        html = self.__run_timed(started,
+                            lambda: sdiff_lines(from_lines, to_lines, obj1,
+                                obj2, True, self.__wrap_num,
+                                self.__context_line))
+                        pages.append(target + '.sdiff.html')
+                        write_file(pages[-1], html)
+
+                        # Fdiff
+                        html = self.__run_timed(started,
+                            lambda: sdiff_lines(from_lines, to_lines, obj1,
+                                obj2, False, self.__wrap_num,
+                                self.__context_line))
+                        pages.append(target + '.fdiff.html')
+                        write_file(pages[-1], html)
+
+                        html = self.__run_timed(started,
+                                                convert_to_html, obj1)
+                        pages.append(target + '-.html')
+                        write_file(pages[-1], html)
+                        html = self.__run_timed(started,
+                                                convert_to_html, obj2)
+                        pages.append(target + '.html')
+                        write_file(pages[-1], html)
+                        file_summary = cdiff_summary
+                    except _BudgetTimeout:
+                        for page in pages:
+                            if os.path.exists(page):
+                                os.remove(page)
+                        level = _budget_udiff
+                        reason = self.__time_reason(started)
+
+                if level == _budget_full:
+                    template = self._diff_data_row_template
+                    page = f_url + '.sdiff.html'
+                elif level == _budget_udiff:
+                    template = self._udiff_data_row_template
+                    page = f_url + '.udiff.html'
+                elif level == _budget_stats:
+                    file_summary = quick_summary(from_lines, to_lines)
+                    template = self._stats_data_row_template
+                    page = ''
+                else:
+                    page = ''
+                    file_summary = { 'changed': '-', 'deleted': '-',
+                                     'added': '-' }
+                    template = self._too_large_data_row_template
 
                 print '  * %-40s |' % f,
-                print 'Changed/Deleted/Added: %d/%d/%d' % (\
-                    file_summary['changed'],
-                    file_summary['deleted'],
-                    file_summary['added'])
-
-                write_file(target + '-.html', convert_to_html(obj1))
-                write_file(target + '.html', convert_to_html(obj2))
-                data_row = self._diff_data_row_template % dict(
+                if level == _budget_skip:
+                    print 'Too large (%s)' % reason
+                else:
+                    print 'Changed/Deleted/Added: %s/%s/%s' % (\
+                        file_summary['changed'],
+                        file_summary['deleted'],
+                        file_summary['added']),
+                    if level == _budget_full:
+                        print
+                    else:
+                        print '(%s, %s)' % (_budget_names[level], reason)
+
+                values = dict(
                     pathname = f,
                     pathname_url = f_url,
                     changed = file_summary['changed'],
                     deleted = file_summary['deleted'],
                     added = file_summary['added'],
+                    reason = reason,
                 )
+                data_row = template % values
+                if level <= _budget_udiff:
+                    groups[key] = dict(pathname=f, target=target, page=page,
+                                       summary=file_summary, members=[],
+                                       row=len(data_rows), template=template,
+                                       values=values)
+                if level != _budget_full:
+                    budget[_budget_keys[level]] += 1
+
+                # Only contents of files rendered in full are searchable
+                grams = set()
+                if level == _budget_full:
+                    grams = self.__search_grams(started, lambda:
+                        search_trigrams(changed_lines(from_lines, to_lines)))
+                update_search_index(search, f, page, grams)
                 summary['changed'] += 1
             else: # this case occured when controlled by master file list
                 print '  * %-40s |' % f,
                 print 'Not found'
                 data_row = ''
 
-            data_rows += data_row
+            data_rows.append([f, data_row])
+
+        # Files with identical change share pages of the first one, list
+        # them in a group page and link it from the first one's row
+        for group in groups.itervalues():
+            if not group['members']:
+                continue
+            members = [group['pathname']] + group['members']
+            base = os.path.dirname(group['pathname']) or os.curdir
+            write_file(group['target'] + '.group.html',
+                       self._group_page_template % dict(
+                pathname = html_filter(group['pathname']),
+                page = os.path.basename(group['page']),
+                count = len(members),
+                members = ''.join([self._group_member_template % dict(
+                    pathname = html_filter(m),
+                    pathname_url = urllib.quote(os.path.relpath(m, base)),
+                ) for m in members]),
+            ))
+            values = group['values']
+            values['pathname'] = '%s <a href="%s.group.html" title="%s">' \
+                '(%d files)</a>' % (values['pathname'],
+                values['pathname_url'], 'files with identical change',
+                len(members))
+            data_rows[group['row']][1] = group['template'] % values
+
+        limits = []
+        if self.__max_lines:
+            limits.append('max %d lines' % self.__max_lines)
+        if self.__max_bytes:
+            limits.append('max %d bytes' % self.__max_bytes)
+        if self.__max_seconds:
+            limits.append('max %s seconds' % self.__max_seconds)
+        budget['limits'] = ', '.join(limits)
+
+        if self.__shard:
+            # Paths are byte strings in any encoding, they are decoded as
+            # latin-1 to pass json losslessly, merge_shards() encodes back
+            k, n = self.__shard
+            write_file(os.path.join(self.__output,
+                                    _shard_fragment_name % (k, n)),
+                       json.dumps(dict(
+                shard = [k, n],
+                obj1 = self.__obj1.decode('latin-1'),
+                obj2 = self.__obj2.decode('latin-1'),
+                has_diff = has_diff,
+                summary = summary,
+                budget = budget,
+                search = search,
+                data_rows = [[f.decode('latin-1'), row.decode('latin-1')]
+                             for f, row in data_rows],
+            )))
+            return has_diff
 
         if not has_diff:
             return False
 
+        if self.__title:
+            title = html_filter(self.__title)
+        else:
+            title = '%s vs %s' % (self.__obj1, self.__obj2)
+        self.__write_index(title, summary, budget, search,
+                           [row for f, row in data_rows])
+        return True
+
+    def __write_index(self, title, summary, budget, search, data_rows):
+        'Write index page and search index'
         # Generate footer info
         footer_info = self._footer_info_template % dict(
             time = time.strftime('%a %b %d %X %Z %Y', time.localtime()),
@@ -631,12 +1192,17 @@ class CodeDiffer:
         )
 
         # now wirte index page
-        if self.__title:
-            title = html_filter(self.__title)
-        else:
-            title = '%s vs %s' % (self.__obj1, self.__obj2)
         header_info = self._header_info_template % {'header': title}
 
+        budget_info = ''
+        if budget['udiff'] or budget['stats'] or budget['skip']:
+            budget_info = self._budget_info_template % budget
+
+        write_search_index(os.path.join(self.__output, _search_index_name),
+                           search)
+        search_info = self._search_info_template % \
+            {'search_index': _search_index_name}
+
         index = open(os.path.join(self.__output, 'index.html'), 'w')
         index.write(self._index_template % dict(
             title = title,
@@ -645,15 +1211,106 @@ class CodeDiffer:
             comments_info = self._comments_template % \
                 {'comments': html_filter(self.__comments)},
             summary_info = self._summary_info_template % summary,
-            data_rows = self._data_rows_template % {'data_rows': data_rows},
+            budget_info = budget_info,
+            search_info = search_info,
+            data_rows = self._data_rows_template % \
+                {'data_rows': ''.join(data_rows)},
             footer_info = footer_info,
         ))
         index.close()
 
+    def __shard_file_list(self):
+        '''
+        Keep only files of this shard, files are assigned to shards greedily
+        from the largest one so shards have balanced total size, every shard
+        computes the same assignment
+        '''
+        k, n = self.__shard
+        sizes = []
+        for f in self.__file_list:
+            size = 0
+            for obj in (self.__obj1, self.__obj2):
+                pathname = os.path.join(obj, f)
+                if os.path.exists(pathname):
+                    size = max(size, os.lstat(pathname)[6])
+            sizes.append((-size, f))
+        sizes.sort()
+
+        totals = [0] * n
+        file_list = []
+        for size, f in sizes:
+            i = totals.index(min(totals))
+            totals[i] -= size
+            if i == k - 1:
+                file_list.append(f)
+        self.__file_list = file_list
+
     def __diff_dir(self):
         self.__make_file_list()
+        if self.__shard:
+            self.__shard_file_list()
         self.__diff_dir_by_list()
 
+    def merge_shards(self):
+        '''
+        Combine index fragments written by all shards in output dir into the
+        final index page, pages of all shards must be copied into output dir
+        '''
+        fragments = {}
+        try:
+            for name in os.listdir(self.__output):
+                m = re.match(_shard_fragment_pattern, name)
+                if m:
+                    fp = open(os.path.join(self.__output, name), 'r')
+                    fragments[(int(m.group(1)), int(m.group(2)))] = \
+                        json.load(fp)
+                    fp.close()
+        except OSError, e:
+            raise CodeDifferError, 'OSError: ' + str(e)
+        except IOError, e:
+            raise CodeDifferError, 'IOError: ' + str(e)
+        except ValueError, e:
+            raise CodeDifferError, 'Bad shard fragment: ' + str(e)
+
+        if not fragments:
+            raise CodeDifferError, 'No shard fragment found in ' + self.__output
+        n = min(fragments.keys())[1]
+        missing = [str(k) for k in range(1, n + 1) if (k, n) not in fragments]
+        if missing or len(fragments) != n:
+            raise CodeDifferError, 'Shard fragments mismatch, expect %d ' \
+                'shards, missing: %s' % (n, ', '.join(missing) or 'none')
+
+        has_diff = False
+        summary = { 'changed': 0, 'added': 0, 'deleted': 0 }
+        budget = { 'udiff': 0, 'stats': 0, 'skip': 0 }
+        search = new_search_index()
+        data_rows = []
+        for k in range(1, n + 1):
+            fragment = fragments[(k, n)]
+            has_diff = has_diff or fragment['has_diff']
+            for key in summary:
+                summary[key] += fragment['summary'][key]
+            for key in budget:
+                budget[key] += fragment['budget'][key]
+            budget['limits'] = fragment['budget']['limits'].encode('latin-1')
+            merge_search_index(search, fragment['search'])
+            data_rows.extend([(f.encode('latin-1'), row.encode('latin-1'))
+                              for f, row in fragment['data_rows']])
+
+        if not has_diff:
+            return False
+
+        data_rows.sort()
+        if self.__title:
+            title = html_filter(self.__title)
+        else:
+            fragment = fragments[(1, n)]
+            title = ('%s vs %s' % (fragment['obj1'],
+                                   fragment['obj2'])).encode('latin-1')
+        self.__write_index(title, summary, budget, search,
+                           [row for f, row in data_rows])
+        return True
+
     def make_diff(self):
         try:
             # Note: use stat instead lstat to permit symbolic links
@@ -695,6 +1352,7 @@ if __name__ == '__main__':
     usage = '''
     %(name)s [options] OLD NEW
     %(name)s OLD NEW [options]
+    %(name)s --merge-shards -o OUTPUT [options]
 
     Diff two files/directories and produce HTML pages.''' % \
     {'name': os.path.basename(sys.argv[0])}
@@ -710,6 +1368,25 @@ if __name__ == '__main__':
                       help='specify a file list to read from, filelist can ' + \
                            'be generated by find -type f, specify - to read' + \
                            ' from stdin')
+    parser.add_option('--max-bytes', dest='maxbytes',
+                      type='int', metavar='NUM', default=0,
+                      help='per-file budget in bytes, larger files are ' + \
+                           'rendered as udiff only, stats only or skipped' + \
+                           ' as they grow, default is no limit')
+    parser.add_option('--max-lines', dest='maxlines',
+                      type='int', metavar='NUM', default=0,
+                      help='per-file budget in lines, works like ' + \
+                           '--max-bytes, default is no limit')
+    parser.add_option('--max-seconds', dest='maxseconds',
+                      type='float', metavar='NUM', default=0,
+                      help='per-file time budget in seconds, when it ' + \
+                           'runs out while diffing the file is rendered as' + \
+                           ' stats only, while rendering other pages as ' + \
+                           'udiff only, default is no limit')
+    parser.add_option('--merge-shards', action='store_true',
+                      dest='mergeshards', default=False,
+                      help='combine index fragments of all shards in ' + \
+                           'output dir into the final index page')
     parser.add_option('-m', '--comments', dest='comments',
                       help='specify inline comments (precedes -F)')
     parser.add_option('-n', '--lines', dest='lines',
@@ -723,6 +1400,11 @@ if __name__ == '__main__':
                       help='for all pathnames in the filelist, delete NUM ' + \
                            'path name components from the beginning of each' + \
                            ' path name, it is similar to patch(1) -p')
+    parser.add_option('--shard', dest='shard', metavar='K/N',
+                      help='process only K-th of N size-balanced slices ' + \
+                           'of the file list of two directories and write ' + \
+                           'an index fragment instead of index page, see ' + \
+                           '--merge-shards')
     parser.add_option('-t', '--title', dest='title',
                       help='specify title of output index page')
     parser.add_option('-w', '--wrap', dest='wrapnum',
@@ -734,10 +1416,26 @@ if __name__ == '__main__':
                       help='do not prompt for overwriting')
     opts, args = parser.parse_args()
 
-    if len(args) != 2:
+    shard = None
+    if opts.shard:
+        m = re.match(r'^(\d+)/(\d+)$', opts.shard)
+        if not m or not 1 <= int(m.group(1)) <= int(m.group(2)):
+            sys.stderr.write("Sorry, shard must be K/N and 1 <= K <= N\n")
+            sys.exit(1)
+        shard = (int(m.group(1)), int(m.group(2)))
+
+    if opts.mergeshards:
+        if args or shard:
+            sys.stderr.write("Sorry, --merge-shards takes no file/directory "
+                             "names and no --shard\n")
+            sys.exit(1)
+    elif len(args) != 2:
         sys.stderr.write("Sorry, you must specify two file/directory names\n" \
                          + "type `%s -h' for help\n" % _self_name)
         sys.exit(1)
+    elif shard and not (os.path.isdir(args[0]) and os.path.isdir(args[1])):
+        sys.stderr.write("Sorry, --shard only works on two directories\n")
+        sys.exit(1)
     if not opts.output:
         sys.stderr.write("Sorry, you must specify output name (use `-o')\n")
         sys.exit(2)
@@ -753,7 +1451,9 @@ if __name__ == '__main__':
     else:
         comments = ''
 
-    if not opts.overwrite and os.path.exists(opts.output):
+    if opts.mergeshards:
+        pass    # output dir is expected to exist
+    elif not opts.overwrite and os.path.exists(opts.output):
         if opts.filelist == '-':
             # stdin redirected, so we cannot read answer from stdin
             print "`%s' exists, please select another output directory, " \
@@ -764,10 +1464,16 @@ if __name__ == '__main__':
                 sys.exit(1)
 
     try:
-        differ = CodeDiffer(args[0], args[1], opts.output, opts.filelist,
-                            opts.striplevel, opts.wrapnum, opts.lines,
-                            opts.title, comments)
-        differ.make_diff()
+        if opts.mergeshards:
+            differ = CodeDiffer('', '', opts.output, title=opts.title,
+                                comments=comments)
+            differ.merge_shards()
+        else:
+            differ = CodeDiffer(args[0], args[1], opts.output, opts.filelist,
+                                opts.striplevel, opts.wrapnum, opts.lines,
+                                opts.title, comments, opts.maxlines,
+                                opts.maxbytes, opts.maxseconds, shard)
+            differ.make_diff()
     except CodeDifferError, e:
         sys.stderr.write(str(e) + '\n')
         sys.exit(1)
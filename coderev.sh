@@ -167,6 +167,7 @@ function set_vcs_ops
     eval vcs_get_active_list=${ident}_get_active_list
     eval vcs_get_diff=${ident}_get_diff
     eval vcs_get_diff_opt=${ident}_get_diff_opt
+    eval vcs_get_base_tree=${ident}_get_base_tree
 }
 
 # VCS Operations: 
@@ -177,6 +178,9 @@ function set_vcs_ops
 #   get_active_list pathname ...      - print active file list
 #   get_diff [diff_opt] pathname ...  - get diffs for active files
 #   get_diff_opt                      - print diff option and args
+#   get_base_tree dir pathname ...    - save working copy base version of
+#                                       active files under dir, return 1 if
+#                                       not supported
 
 function unknown_get_banner
 {
@@ -193,6 +197,10 @@ set_vcs_ops $(detect_vcs)
 
 ####################  VCS Operations End #################### 
 
+# Publishing operations
+#
+. $BINDIR/libpub.sh || exit 1
+
 # Main Proc
 #
 CODEREV_NAME=
@@ -282,49 +290,68 @@ sed 's/^/  * /' $ACTIVE_LIST
 #
 mkdir -p $BASE_SRC || exit 1
 
-SRC_LIST=""
-for f in $(cat $ACTIVE_LIST); do
-    [[ -f $f ]] && SRC_LIST+=" $f"
-done
-
-if [[ -n $SRC_LIST ]]; then
-    tar -cf - $SRC_LIST | tar -C $BASE_SRC -xf - || exit 1
+# For default "<vcs> diff" case, read base files directly from working copy
+# if VCS supports, this avoids the diff/patch round trip
+#
+BASE_FROM_VCS=false
+if ! $RECV_STDIN && [[ -z $REV_ARG ]]; then
+    echo -e "\nRetrieving base files..."
+    if $vcs_get_base_tree $BASE_SRC $(cat $ACTIVE_LIST); then
+        BASE_FROM_VCS=true
+    else
+        echo "Base files not available, using diffs instead."
+    fi
 fi
 
-if $RECV_STDIN; then
-    PATCH_LVL=${PATCH_LVL:-0}
+if $BASE_FROM_VCS; then
+    REVERSE_PATCH=true  # $BASE_SRC is the old one
 else
-    echo -e "\nRetrieving diffs..."
-    VCS_REV_OPT=""
-    [[ -n $REV_ARG ]] && VCS_REV_OPT="$($vcs_get_diff_opt $REV_ARG)"
-    $vcs_get_diff $VCS_REV_OPT $(cat $ACTIVE_LIST) > $DIFF || exit 1
-    # PATCH_LVL default to 0
-fi
+    rm -rf $BASE_SRC && mkdir -p $BASE_SRC || exit 1
 
-# If we are not receiving patch set from stdin and not using "-r" option, it
-# then means we are working on patch set from default "<vcs> diff", in this
-# case "patch -R" is required, otherwise we try patch (dry-run) to detect
-# errors and reverse patch in advance, then do real patch
-#
-PATCH_OPT="-E -t -p $PATCH_LVL -d $BASE_SRC"
-if ! $RECV_STDIN && [[ -z $REV_ARG ]]; then
-    REVERSE_PATCH=true
-    PATCH_OPT+=" -R"
-else
-    patch $PATCH_OPT --dry-run < $DIFF > $PATCH_DRY_RUN_LOG 2>&1
-    if grep -Eq 'Reversed .* detected.*Assum.* -R|No file to patch' \
-       $PATCH_DRY_RUN_LOG 2>&1; then
+    SRC_LIST=""
+    for f in $(cat $ACTIVE_LIST); do
+        [[ -f $f ]] && SRC_LIST+=" $f"
+    done
+
+    if [[ -n $SRC_LIST ]]; then
+        tar -cf - $SRC_LIST | tar -C $BASE_SRC -xf - || exit 1
+    fi
+
+    if $RECV_STDIN; then
+        PATCH_LVL=${PATCH_LVL:-0}
+    else
+        echo -e "\nRetrieving diffs..."
+        VCS_REV_OPT=""
+        [[ -n $REV_ARG ]] && VCS_REV_OPT="$($vcs_get_diff_opt $REV_ARG)"
+        $vcs_get_diff $VCS_REV_OPT $(cat $ACTIVE_LIST) > $DIFF || exit 1
+        # PATCH_LVL default to 0
+    fi
+
+    # If we are not receiving patch set from stdin and not using "-r" option,
+    # it then means we are working on patch set from default "<vcs> diff", in
+    # this case "patch -R" is required, otherwise we try patch (dry-run) to
+    # detect errors and reverse patch in advance, then do real patch
+    #
+    PATCH_OPT="-E -t -p $PATCH_LVL -d $BASE_SRC"
+    if ! $RECV_STDIN && [[ -z $REV_ARG ]]; then
         REVERSE_PATCH=true
         PATCH_OPT+=" -R"
+    else
+        patch $PATCH_OPT --dry-run < $DIFF > $PATCH_DRY_RUN_LOG 2>&1
+        if grep -Eq 'Reversed .* detected.*Assum.* -R|No file to patch' \
+           $PATCH_DRY_RUN_LOG 2>&1; then
+            REVERSE_PATCH=true
+            PATCH_OPT+=" -R"
+        fi
     fi
-fi
 
-# Do real patch with option "-f" (force)
-patch $PATCH_OPT -f < $DIFF > $PATCH_LOG 2>&1
-if grep -q 'FAILED -- .* reject' $PATCH_LOG; then
-    cat $PATCH_LOG
-    echo "Failed to apply patch, aborting..." >&2
-    exit 1
+    # Do real patch with option "-f" (force)
+    patch $PATCH_OPT -f < $DIFF > $PATCH_LOG 2>&1
+    if grep -q 'FAILED -- .* reject' $PATCH_LOG; then
+        cat $PATCH_LOG
+        echo "Failed to apply patch, aborting..." >&2
+        exit 1
+    fi
 fi
 
 # Form codediff options
@@ -417,8 +444,10 @@ if [[ -z "$OUTPUT_DIR" ]]; then
     LOC_PREFIX=""
     [[ -n $WEB_HOST ]] && LOC_PREFIX="${SSH_USER}@${WEB_HOST}:"
 
-    echo -e "\nCopying to ${LOC_PREFIX}$HOST_DIR/..."
-    eval scp -rpq $CODEREV ${LOC_PREFIX}$HOST_DIR/ || exit 1
+    # Only added or changed pages are transferred, see libpub.sh
+    echo -e "\nPublishing to ${LOC_PREFIX}$HOST_DIR/..."
+    pub_publish $CODEREV "$HOST_DIR/$(basename $CODEREV)" \
+        ${WEB_HOST:+${SSH_USER}@${WEB_HOST}} || exit 1
 
     echo -e "\nCoderev link:"
     echo "$WEB_URL/$(basename $CODEREV)"
@@ -60,3 +60,9 @@ function cvs_get_diff_opt
 {
     echo "-r $1"
 }
+
+function cvs_get_base_tree
+{
+    # Not supported, base tree is recovered by reversing "cvs diff"
+    return 1
+}
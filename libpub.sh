@@ -0,0 +1,84 @@
+# Homepage: http://code.google.com/p/coderev
+# License: GPLv2, see "COPYING"
+#
+# This library implements delta publishing of coderev pages, see comments in
+# coderev.sh
+#
+# A manifest of page hashes is kept at the destination, only added or changed
+# pages are transferred (in a single tar stream), and pages no longer present
+# are removed from the destination.
+#
+# $Id$
+
+PUB_MANIFEST=".coderev-manifest"
+PUB_STALE=".coderev-stale"
+PUB_UNKNOWN_HASH="00000000000000000000000000000000"
+
+# Print "md5sum  pathname" for every page under dir, sorted by pathname
+#
+function pub_make_manifest
+{
+    local dir=${1?"dir required"}
+
+    (cd $dir && find . -type f ! -name '.coderev-*' | sed 's|^\./||' \
+        | LC_ALL=C sort | tr '\n' '\0' | xargs -0 -r md5sum --)
+}
+
+# Usage: pub_publish srcdir destdir [user@host]
+#
+# Publish srcdir as destdir, on host via ssh if given, otherwise on local
+# filesystem.  destdir is evaluated by the (remote) shell, so "~" is allowed
+#
+function pub_publish
+{
+    local src=${1?"source dir required"}
+    local dest=${2?"destination dir required"}
+    local host=$3
+    local run="sh -c"
+    local tmp nchanged nstale
+
+    [[ -n $host ]] && run="ssh $host"
+    tmp=$(mktemp -d /tmp/coderev-pub.XXXXXX) || return 1
+
+    pub_make_manifest $src > $tmp/$PUB_MANIFEST || {
+        rm -rf $tmp
+        return 1
+    }
+    # Without a manifest (e.g. destination copied by scp), take every file at
+    # destination as an old page with unknown hash, so all pages are sent and
+    # files not in new manifest are removed
+    $run "if [ -f $dest/$PUB_MANIFEST ]; then
+              cat $dest/$PUB_MANIFEST
+          elif [ -d $dest ]; then
+              cd $dest && find . -type f ! -name '.coderev-*' \
+                  | sed 's|^\./||; s|^|$PUB_UNKNOWN_HASH  |'
+          fi" > $tmp/old-manifest || {
+        rm -rf $tmp
+        return 1
+    }
+
+    # md5sum prints 32 hex digits and 2 spaces before pathname
+    LC_ALL=C comm -23 <(LC_ALL=C sort $tmp/$PUB_MANIFEST) \
+        <(LC_ALL=C sort $tmp/old-manifest) | cut -c35- > $tmp/changed
+    LC_ALL=C comm -13 <(cut -c35- $tmp/$PUB_MANIFEST) \
+        <(cut -c35- $tmp/old-manifest | LC_ALL=C sort) > $tmp/$PUB_STALE
+
+    nchanged=$(wc -l < $tmp/changed)
+    nstale=$(wc -l < $tmp/$PUB_STALE)
+    echo "  * $nchanged page(s) added or changed, $nstale stale page(s)"
+
+    # Ship changed pages, new manifest and stale list in one stream, then
+    # remove stale pages and directories left empty at the destination
+    tar -cf - -C $src --verbatim-files-from -T $tmp/changed \
+        -C $tmp $PUB_MANIFEST $PUB_STALE \
+        | $run "mkdir -p $dest && cd $dest && tar -xpf - \
+                && tr '\n' '\0' < $PUB_STALE | xargs -0 -r rm -f -- \
+                && rm -f $PUB_STALE \
+                && find . -mindepth 1 -type d -empty -delete" || {
+        rm -rf $tmp
+        return 1
+    }
+
+    rm -rf $tmp
+    return 0
+}
@@ -58,3 +58,40 @@ function svn_get_diff_opt
 {
     echo "-r $1"
 }
+
+function svn_get_base_tree
+{
+    local dir=${1?"dir required"}
+    local st info skip files jobs
+    shift
+
+    st=$(svn st $@) || return 1
+    info=$(svn info $@) || return 1
+
+    # Nodes without BASE text are skipped: directories by BASE kind (a dir
+    # removed by "svn rm" is gone from disk) and files scheduled for addition
+    # without history ("A" but no "+" in column 4)
+    skip=$(echo "$info" \
+        | awk '/^Path: / {p = substr($0, 7)} /^Node Kind: directory$/ {print p}'
+        echo "$st" | grep '^A..[^+]' | cut -c8- | sed 's/^ *//')
+    files=$(printf '%s\n' $@ | grep -Fxv -f <(echo "$skip"))
+    [[ -n $files ]] || return 0
+
+    (mkdir -p $dir && cd $dir && echo "$files" | tr '\n' '\0' \
+        | xargs -0 dirname -- | sort -u | tr '\n' '\0' \
+        | xargs -0 mkdir -p --) || return 1
+
+    # BASE is read from pristine copies in working copy, no server access,
+    # keywords are expanded as in working files.  "svn cat" concatenates
+    # multiple targets without any delimiter so it runs once per file, in
+    # parallel to hide process startup cost.  The trailing "@" keeps "@" in
+    # file names from being taken as peg revision
+    jobs=$(getconf _NPROCESSORS_ONLN 2>/dev/null) || jobs=4
+    echo "$files" | tr '\n' '\0' \
+        | xargs -0 -n 1 -P $jobs sh -c 'svn cat -r BASE "$1@" > "$0/$1"' $dir \
+        || {
+        echo "Failed to read BASE of active files from working copy." >&2
+        return 1
+    }
+    return 0
+}
@@ -0,0 +1,112 @@
+#!/bin/bash
+#
+# Homepage: http://code.google.com/p/coderev
+# License: GPLv2, see "COPYING"
+#
+# Test svn_get_base_tree against a local file:// repository, and time it
+# against the old "tar copy, svn diff, patch -R" way of building base tree
+#
+# Usage: test/svn_base_tree.sh [count]
+#
+#   count   - number of extra modified files for timing, default is 200
+#
+# $Id$
+
+BINDIR=$(cd $(dirname $0)/.. && pwd -P) || exit 1
+COUNT=${1:-200}
+
+. $BINDIR/libsvn.sh || exit 1
+
+TMP=$(mktemp -d /tmp/coderev-test.XXXXXX) || exit 1
+trap "rm -rf $TMP" EXIT
+FAILED=0
+
+function check
+{
+    local desc=${1?} cond=${2?}
+
+    if eval "$cond"; then
+        echo "  ok     $desc"
+    else
+        echo "  FAILED $desc"
+        FAILED=1
+    fi
+}
+
+# Prepare repository and working copy
+#
+svnadmin create $TMP/repo || exit 1
+svn co -q file://$TMP/repo $TMP/wc || exit 1
+cd $TMP/wc || exit 1
+
+echo "mod v1" > mod.c
+echo "src v1" > src.c
+echo "del v1" > del.c
+mkdir -p deldir sub
+echo "x v1" > deldir/x.c
+printf '$Id$\nkw v1\n' > kw.c
+for i in $(seq $COUNT); do
+    printf 'line 1\nline 2 of %d\nline 3\n' $i > sub/f$i.c
+done
+svn add -q mod.c src.c del.c deldir kw.c sub
+svn ps -q svn:keywords Id kw.c
+svn ci -q -m 'initial import' || exit 1
+svn up -q
+
+# Local modifications: modified, added, copied, deleted file and directory
+#
+echo "mod v2" >> mod.c
+echo "new v1" > new.c
+svn add -q new.c
+svn cp -q src.c copy.c
+echo "copy v2" >> copy.c
+svn rm -q del.c deldir
+echo "kw v2" >> kw.c
+for i in $(seq $COUNT); do
+    echo "line 4" >> sub/f$i.c
+done
+
+ACTIVE=$(svn_get_active_list . | sort -u)
+
+echo "svn_get_base_tree:"
+start=$(date +%s.%N)
+svn_get_base_tree $TMP/base $ACTIVE
+rc=$?
+end=$(date +%s.%N)
+check "returns 0" "[[ $rc == 0 ]]"
+check "modified file has BASE text" \
+      "[[ \$(cat $TMP/base/mod.c) == 'mod v1' ]]"
+check "added file has no BASE" "[[ ! -e $TMP/base/new.c ]]"
+check "copied file has text of copy source" \
+      "[[ \$(cat $TMP/base/copy.c) == 'src v1' ]]"
+check "deleted file has BASE text" \
+      "[[ \$(cat $TMP/base/del.c) == 'del v1' ]]"
+check "file in deleted dir has BASE text" \
+      "[[ \$(cat $TMP/base/deldir/x.c) == 'x v1' ]]"
+check "keywords are expanded as in working file" \
+      "[[ \$(head -1 $TMP/base/kw.c) == \$(head -1 kw.c) ]]"
+check "bulk modified files have BASE text" \
+      "[[ \$(cat $TMP/base/sub/f1.c | wc -l) == 3 ]]"
+NEW_TIME=$(awk "BEGIN {print $end - $start}")
+
+echo "tar copy, svn diff, patch -R:"
+start=$(date +%s.%N)
+mkdir -p $TMP/old
+SRC_LIST=""
+for f in $ACTIVE; do
+    [[ -f $f ]] && SRC_LIST+=" $f"
+done
+tar -cf - $SRC_LIST | tar -C $TMP/old -xf -
+svn_get_diff $ACTIVE > $TMP/diffs
+patch -E -t -p 0 -d $TMP/old -R -f < $TMP/diffs > $TMP/patch.log 2>&1
+end=$(date +%s.%N)
+check "patch applied without reject" \
+      "! grep -q 'FAILED -- .* reject' $TMP/patch.log"
+OLD_TIME=$(awk "BEGIN {print $end - $start}")
+
+echo
+echo "Time for $(echo "$ACTIVE" | wc -l) active paths:"
+echo "  svn_get_base_tree           : $NEW_TIME s"
+echo "  tar copy, svn diff, patch -R: $OLD_TIME s"
+
+exit $FAILED